@@ -2,7 +2,77 @@
 
 from ripe.atlas.cousteau import Probe, ProbeRequest
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import logging
 import math
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    from sklearn.neighbors import BallTree
+except ImportError:
+    BallTree = None
+
+try:
+    from greedy import greedy_select #Compiled Cython kernel; build with 'python setup.py build_ext --inplace'.
+except ImportError:
+    greedy_select = None
+
+if njit is not None:
+    @njit(fastmath=True, cache=True, inline='always')
+    def _bsin(x):
+        """Bhaskara's sine approximation for x in [0, pi]: pure multiplies and adds, so LLVM can
+        SIMD it, unlike a libm sin call. The error (<0.2%) is irrelevant for ranking max-min picks.
+        """
+        y = x * (math.pi - x)
+        return 4 * y / (5 * math.pi * math.pi - 4 * y)
+
+    @njit(fastmath=True, cache=True)
+    def _update_and_argmax(lats, lons, cos_lats, lat0, lon0, cos_lat0, min_a, eligible):
+        """Fused per-iteration kernel: updates min_a against the probe at (lat0, lon0) and
+        returns the index of the eligible probe with the largest min_a (-1 if none are eligible).
+        min_a holds the haversine 'a' term rather than km: asin and sqrt are monotonic, so the
+        ordering is identical and both transcendentals are skipped. Doing all of this in one
+        compiled pass avoids allocating NumPy temporaries every iteration.
+        cos_lats holds the precomputed cos(latitude) per probe; cos_lat0 is cos(lat0).
+        """
+        best_val = -1.0
+        best_idx = -1
+        for i in range(lats.shape[0]):
+            #sin is odd and both terms are squared, so taking abs() of the half-differences is exact
+            #and keeps the arguments in [0, pi] where the Bhaskara approximation holds.
+            sin_dlat = _bsin(abs(lats[i] - lat0)/2)
+            lower_bound = sin_dlat * sin_dlat #The latitude term alone already lower-bounds 'a'.
+            if lower_bound < min_a[i]:
+                #Only probes the new selection might actually be closer to pay for the longitude term.
+                sin_dlon = _bsin(abs(lons[i] - lon0)/2)
+                a = lower_bound + cos_lats[i] * cos_lat0 * sin_dlon * sin_dlon
+                if a < min_a[i]:
+                    min_a[i] = a
+            if eligible[i] and min_a[i] > best_val:
+                best_val = min_a[i]
+                best_idx = i
+        return best_idx
+else:
+    _update_and_argmax = None
+
+_TILE = 4096 #Block size for the NumPy fallback: the handful of float64 temporaries per block (~32 KB each) stay in L2.
+
+def _update_min_a_blocked(lats, lons, cos_lats, lat0, lon0, cos_lat0, min_a):
+    """NumPy fallback for the per-iteration min_a update, processed in _TILE-sized blocks.
+    Whole-array expressions on ~10k+ probes materialize several size-n temporaries that spill
+    out of L2 and get re-fetched; blocking keeps each batch of temporaries cache-resident.
+    """
+    for start in range(0, len(lats), _TILE):
+        end = start + _TILE
+        a = np.sin((lats[start:end] - lat0)/2)**2 + cos_lats[start:end] * cos_lat0 * np.sin((lons[start:end] - lon0)/2)**2
+        np.minimum(min_a[start:end], a, out=min_a[start:end])
 
 def select_diverse_subset(probe_list, k, probes_per_asn = math.inf):
     """Selects k probes, given a list of probes, to maximize geographic diversity. 
@@ -24,52 +94,107 @@ def select_diverse_subset(probe_list, k, probes_per_asn = math.inf):
         A subset of probe_list, of length k, that maximizes geographic diversity. 
     """
 
-    print("Selecting", k, "probes for diversity...this may take a while.")
+    logger.info("Selecting %s probes for diversity...this may take a while.", k)
     probes = [probe for probe in probe_list if probe['geometry'] is not None]
     if len(probes) < len(probe_list):
-        print("Alert: some probes coordinates are not known (or are software probes). These will not be chosen.")
+        logger.info("Alert: some probes coordinates are not known (or are software probes). These will not be chosen.")
 
-    selected = [probes[0]] #Arbitrarily selects first probe to start. 
-    asn_counts = Counter({selected[0]['asn_v4']: 1}) #Counts occurences of ASNs we selected. 
-    #asn_v4 and asn_v6 for the same probe are rarely different, so for simplicity only asn_v4 is considered. 
-    probes = probes[1:] 
-    
-    while len(selected) < k and len(probes) > 0: #Selects probes one at a time, based on diversity, until k have been chosen.
-        #Considers only probes which obey ASN constraint
-        probes = [probe for probe in probes if asn_counts[probe['asn_v4']] < probes_per_asn] 
-        select = next_diverse_selection(probes, selected) 
-        selected.append(select)
-        key = select['asn_v4'] if select['asn_v4'] is not None else "unknown"
-        asn_counts[select['asn_v4']] += 1
-        probes.remove(select) 
-        
-    return selected  
-
-def next_diverse_selection(probes, selected):
-    """Selects the next probe to maximize geographic diversity from the already selected.
+    #Struct-of-arrays layout: coordinates and ASNs are pulled out of the dicts once, so the
+    #selection loop only touches contiguous NumPy arrays. The dict list is kept just for the return value.
+    n = len(probes)
+    lats_rad = np.radians(np.fromiter((probe['geometry']['coordinates'][1] for probe in probes), dtype=np.float64, count=n))
+    lons_rad = np.radians(np.fromiter((probe['geometry']['coordinates'][0] for probe in probes), dtype=np.float64, count=n))
+    #Every probe's latitude enters many distance evaluations, so its cosine is computed once up front.
+    cos_lats = np.cos(lats_rad)
+
+    #With the default cap of infinity (or any cap no probe count can reach) the ASN constraint can
+    #never bind, so all of its bookkeeping is skipped in the common case.
+    constrain_asn = probes_per_asn < n
+    if constrain_asn:
+        #asn_v4 and asn_v6 for the same probe are rarely different, so for simplicity only asn_v4 is considered.
+        #Probes with an unknown ASN are grouped under -1.
+        asns = np.fromiter((probe['asn_v4'] if probe['asn_v4'] is not None else -1 for probe in probes), dtype=np.int64, count=n)
+        asn_counts = Counter({asns[0]: 1}) #Counts occurences of ASNs we selected.
+
+    if greedy_select is not None:
+        #The compiled Cython kernel runs the entire greedy loop natively (and releases the GIL
+        #during each sweep), so the Python-level loop below is bypassed altogether.
+        asn_arr = asns if constrain_asn else np.empty(0, dtype=np.int64)
+        return [probes[i] for i in greedy_select(lats_rad, lons_rad, cos_lats, asn_arr, k, float(probes_per_asn))]
+
+    selected = [0] #Arbitrarily selects first probe to start. Everything is tracked by index into the arrays.
+    alive = np.ones(n, dtype=bool) #Candidates still available for selection.
+    alive[0] = False
+    #The seed selection may already put its ASN at the cap (e.g. probes_per_asn = 1). Mask it here
+    #so the incremental invariant -- every ASN at the cap has its probes masked -- holds from the start.
+    if constrain_asn and 1 >= probes_per_asn:
+        alive[asns == asns[0]] = False
+    #Closeness to the nearest selected probe so far, stored as the haversine 'a' term. Converting
+    #'a' to km is monotonic, so ranking on 'a' picks the same probe without asin/sqrt per pair.
+    min_a = np.full(n, np.inf)
+    last = 0 #Only the newest selection can lower a probe's min_a, so each iteration updates against it alone.
+
+    while len(selected) < k and alive.any(): #Selects probes one at a time, based on diversity, until k have been chosen.
+        if _update_and_argmax is not None: #Fused Numba kernel: one pass, no temporaries.
+            best = int(_update_and_argmax(lats_rad, lons_rad, cos_lats, lats_rad[last], lons_rad[last], cos_lats[last], min_a, alive))
+        else:
+            _update_min_a_blocked(lats_rad, lons_rad, cos_lats, lats_rad[last], lons_rad[last], cos_lats[last], min_a)
+            best = int(np.where(alive, min_a, -1.0).argmax())
+        if best < 0 or not alive[best]:
+            break
+        selected.append(best)
+        alive[best] = False
+        if constrain_asn:
+            asn_counts[asns[best]] += 1
+            #Enforces the ASN constraint incrementally: once an ASN reaches the cap, mask out all its
+            #probes in one vector compare instead of re-checking every probe's count each iteration.
+            if asn_counts[asns[best]] >= probes_per_asn:
+                alive[asns == asns[best]] = False
+        last = best
+
+    return [probes[i] for i in selected]
+
+def next_diverse_selection(lats_rad, lons_rad, candidates, selected):
+    """Selects the index of the next probe to maximize geographic diversity from the already selected.
     This is done using the maximum of minimum distances. In other words, we choose the probe
-    where even its closest neighbor is as distant as possible.
+    where even its closest neighbor is as distant as possible. The coordinates are radian arrays
+    indexed by `candidates` and `selected`.
     """
-    
-    max_min_dist = -1 
-    best_probe = None
-    for probe in probes:
-        min_dist = math.inf
-        for select in selected: 
-            dist = great_circle_distance(probe, select) 
-            if dist < min_dist:
-                min_dist = dist
-        if(min_dist > max_min_dist): 
-            max_min_dist = min_dist
-            best_probe = probe
-    return best_probe   
+
+    cand_lats = lats_rad[candidates]
+    cand_lons = lons_rad[candidates]
+    if BallTree is not None and len(selected) > 32:
+        #For many selected probes a BallTree on the haversine metric answers all nearest-selected
+        #queries in O(n log k) instead of sweeping the candidates once per selected probe.
+        tree = BallTree(np.column_stack((lats_rad[selected], lons_rad[selected])), metric='haversine')
+        dists, _ = tree.query(np.column_stack((cand_lats, cand_lons)), k=1)
+        nearest = dists[:, 0] * 6371
+    else:
+        nearest = np.full(len(candidates), np.inf) #Distance from each candidate to its closest selected probe.
+        for i in selected:
+            dists = haversine_vec(cand_lats, cand_lons, lats_rad[i], lons_rad[i])
+            nearest = np.minimum(nearest, dists)
+    return int(candidates[nearest.argmax()])
+
+def haversine_vec(lats, lons, lat0, lon0):
+    """Returns the spherical distances in km from every (lats[i], lons[i]) pair to the point (lat0, lon0).
+    All inputs are in radians. This is the same haversine formula as great_circle_distance, but computed
+    over whole NumPy arrays at once instead of one pair at a time.
+    """
+    a = np.sin((lats - lat0)/2)**2 + np.cos(lats) * np.cos(lat0) * np.sin((lons - lon0)/2)**2
+    return 2 * 6371 * np.arcsin(np.sqrt(a))
 
 def great_circle_distance(probe1, probe2):
-    """Returns the spherical distance between two probes, using their latitude and longtidue values."""
+    """Returns the spherical distance between two probes, using their latitude and longtidue values.
+    This is a convenience API for one-off distances; the selection loop converts every coordinate
+    to radians once up front and never calls this.
+    """
+
+    geo1, geo2 = probe1['geometry']['coordinates'], probe2['geometry']['coordinates']
+    #Converts degrees to radians
+    long1, lat1 = math.radians(geo1[0]), math.radians(geo1[1])
+    long2, lat2 = math.radians(geo2[0]), math.radians(geo2[1])
 
-    geo1, geo2 = [probe1['geometry']['coordinates'], probe2['geometry']['coordinates']]
-    long1, lat1, long2, lat2 = map(math.radians, [geo1[0], geo1[1], geo2[0], geo2[1]]) #Converts degrees to radians
-    
     # haversine formula 
     a = math.sin((lat2 - lat1)/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin((long2 - long1)/2)**2
     c = 2 * math.asin(math.sqrt(a)) 
@@ -84,25 +209,28 @@ def get_probes_by_tag(and_tags = dual_stack_tags, or_tags = version_tags):
     By default, this is used to retrieve only probes that are IPv4 and IPv6 capable,
     and are one of the recent hardware versions (v3, v4 or anchor). 
     """
-    print("Selecting probes from Ripe-Atlas...this may take a while.")
-    probes = []
+    logger.info("Selecting probes from Ripe-Atlas...this may take a while.")
+    #A probe matching several or_tags (e.g. both system-anchor and system-v4) would otherwise appear
+    #once per tag, wasting distance computations downstream. Keying by id keeps only the first copy.
+    probes = {}
     for tag in or_tags:
-        filters = {"tags" : and_tags + tag, "status" : "1"} 
+        filters = {"tags" : and_tags + tag, "status" : "1"}
         collection = ProbeRequest(**filters)
         for probe in collection:
-            probes.append(probe)
-    return probes
+            probes.setdefault(probe['id'], probe)
+    return list(probes.values())
 
 def get_probes_by_id(id_list):
     """Returns a list of probe data such as coordinates, given probe ids.
     This is necessary for using select_diverse_subset() with probe ids. 
     """
-    print("Fetching probe data from Ripe-Atlas...this may take a while.")
-    probe_list = []
-    for probe_id in id_list:
-        probe = Probe(id=probe_id)
-        probe_list.append({"id" : probe_id, "asn_v4" : probe.asn_v4, "geometry" : probe.geometry})
-    return probe_list
+    logger.info("Fetching probe data from Ripe-Atlas...this may take a while.")
+    #Each Probe() is its own round-trip to Ripe-Atlas, so the wall-clock cost is pure network
+    #latency. Fetching them concurrently keeps the same order as id_list.
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        probes = executor.map(lambda probe_id: Probe(id=probe_id), id_list)
+        return [{"id" : probe_id, "asn_v4" : probe.asn_v4, "geometry" : probe.geometry}
+                for probe_id, probe in zip(id_list, probes)]
 
 def print_probe_list(probe_list):
     """Prints the id, asn and coordinates for each probe in probe_list."""
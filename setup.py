@@ -0,0 +1,13 @@
+"""Builds the optional compiled greedy-selection kernel: python setup.py build_ext --inplace"""
+
+from setuptools import Extension, setup
+from Cython.Build import cythonize
+
+extensions = [
+    Extension("greedy", ["greedy.pyx"], extra_compile_args=["-O3", "-ffast-math"]),
+]
+
+setup(
+    name="probe-filters",
+    ext_modules=cythonize(extensions),
+)